@@ -1,5 +1,7 @@
+import math
 from netsquid.components.models import QuantumErrorModel
 import netsquid.util.simtools as simtools
+from netsquid.qubits import qubitapi as qapi
 from netsquid.util.simlog import warn_deprecated
 import numpy as np
 
@@ -7,6 +9,8 @@ __all__ = [
     "FibreLossModel",
 ]
 
+_DB_TO_NEPER = math.log(10) / 10                                                                                        # 10 ** (-x / 10) == exp(-x * _DB_TO_NEPER)
+
 class FibreLossModel(QuantumErrorModel):
     """Model for exponential photon loss on fibre optic channels.
 
@@ -53,6 +57,8 @@ class FibreLossModel(QuantumErrorModel):
         if value < 0:                                                                                                   # FIXME: Modified to accomadate newly expected range in dB
             raise ValueError
         self.properties['loss_init'] = value
+        self._prob_success_init = math.exp(-value * _DB_TO_NEPER)                                                       # cache survival probability of initial loss, invariant between calls to error_operation
+        self._prob_loss_cache = {}
 
     @property
     def p_loss_length(self):
@@ -64,6 +70,7 @@ class FibreLossModel(QuantumErrorModel):
         if value < 0:
             raise ValueError
         self.properties['p_loss_length'] = value
+        self._prob_loss_cache = {}                                                                                      # cached loss probabilities depend on p_loss_length, invalidate them
 
     def error_operation(self, qubits, delta_time=0, **kwargs):
         """Error operation to apply to qubits.
@@ -83,13 +90,19 @@ class FibreLossModel(QuantumErrorModel):
             kwargs['length'] = kwargs['channel'].properties["length"]
             del kwargs['channel']
         #self.apply_loss(qubits, delta_time, **kwargs)
-        for idx, qubit in enumerate(qubits):
+        length = kwargs['length']
+        prob_loss = self._prob_loss_cache.get(length)                                                                   # channel length is fixed during a simulation, so this is computed once per channel
+        if prob_loss is None:
+            prob_success_len = math.exp(-length * self.p_loss_length * _DB_TO_NEPER)
+            prob_loss = 1.0 - self._prob_success_init * prob_success_len                                                # FIXME: Modifed to use dB on 'loss_init'
+            self._prob_loss_cache[length] = prob_loss
+        lost = self.properties['rng'].random_sample(len(qubits)) <= prob_loss                                           # draw loss outcome for every qubit in a single call
+        for idx in np.flatnonzero(lost):
+            qubit = qubits[idx]
             if qubit is None:
                 continue
-            prob_success_init = np.power(10, - self.loss_init / 10)
-            prob_success_len = np.power(10, - kwargs['length'] * self.p_loss_length / 10)
-            prob_loss = 1 - (prob_success_init * prob_success_len)         # FIXME: Modifed to use dB on 'loss_init'
-            self.lose_qubit(qubits, idx, prob_loss, rng=self.properties['rng'])
+            qapi.discard(qubit)
+            qubits[idx] = None
 
     def prob_item_lost(self, item, delta_time=0, **kwargs):
         # DEPRECATED
@@ -13,6 +13,9 @@ class FreeSpaceErrorModel(QuantumErrorModel):
         super().__init__()
         self._properties.update({'rng': rng, 'static_loss_prob': static_loss_prob, 'length': length,
                                  'damping_rate': damping_rate})
+        self._is_total_loss = math.isclose(static_loss_prob, 1.0)                                                       # every qubit is lost, no sampling required
+        self._gamma = 0
+        self._gamma_dirty = True                                                                                        # gamma is recomputed on next error_operation after length/damping_rate change
 
 
     @property
@@ -33,6 +36,7 @@ class FreeSpaceErrorModel(QuantumErrorModel):
     @static_loss_prob.setter
     def static_loss_prob(self, value):
         self._properties['static_loss_prob'] = value
+        self._is_total_loss = math.isclose(value, 1.0)
 
     @property
     def length(self):
@@ -41,6 +45,7 @@ class FreeSpaceErrorModel(QuantumErrorModel):
     @length.setter
     def length(self, value):
         self._properties['length'] = value
+        self._gamma_dirty = True
 
     @property
     def damping_rate(self):
@@ -49,6 +54,7 @@ class FreeSpaceErrorModel(QuantumErrorModel):
     @damping_rate.setter
     def damping_rate(self, value):
         self._properties['damping_rate'] = value
+        self._gamma_dirty = True
 
     @staticmethod
     def lose_qubit(qubits, qubit_index, prob_loss=1.0, rng=None):                                                       # override of "lose_qubit" method to consider both static qubit loss (using lose_qubit) and noise (using amplitude dampening)
@@ -70,14 +76,27 @@ class FreeSpaceErrorModel(QuantumErrorModel):
             Time qubits have spent on a component [ns].
 
         """
-        for idx, qubit in enumerate(qubits):
+        if self._gamma_dirty:
+            self._gamma = self.properties["damping_rate"] * self.properties["length"]                                   # FIXME: figure out reasonable function for this, behavior when gamma->1.0 ?
+            self._gamma_dirty = False
+        gamma = self._gamma
+        static_loss_prob = self.properties["static_loss_prob"]
+        if static_loss_prob == 0 and gamma == 0:
+            return                                                                                                      # nothing to apply, skip qubit API calls entirely
+
+        lost = None
+        if self._is_total_loss:
+            lost = np.ones(len(qubits), dtype=bool)
+        elif static_loss_prob != 0:
+            rng = self.properties["rng"]
+            if rng is None:
+                rng = simtools.get_random_state()
+            lost = rng.random_sample(len(qubits)) <= static_loss_prob                                                   # sample static loss of all qubits at once
+        for idx, qubit in enumerate(qubits):                                                                            # single pass: qubits are either lost or damped
             if qubit is None:
                 continue
-            prob_loss = self.properties["static_loss_prob"]
-            self.lose_qubit(qubits, idx, prob_loss, rng=self.properties["rng"])
-
-        for idx, qubit in enumerate(qubits):
-            if qubit is None:
-                continue
-            gamma = self.properties["damping_rate"] * self.properties["length"]                                  # FIXME: figure out reasonable function for this, behavior when gamma->1.0 ?
-            qapi.amplitude_dampen(qubit, gamma=gamma)
\ No newline at end of file
+            if lost is not None and lost[idx]:
+                qapi.discard(qubit)
+                qubits[idx] = None
+            elif gamma != 0:
+                qapi.amplitude_dampen(qubit, gamma=gamma)
\ No newline at end of file
@@ -1,3 +1,6 @@
+from collections import deque
+from enum import IntEnum
+import heapq
 import numpy as np
 import netsquid as ns
 from netsquid.protocols import NodeProtocol, Signals
@@ -7,8 +10,29 @@ __all__ = [
     "RepeaterProtocol",
     "MemoryRouting",
     "MemoryAccess",
+    "SlotStatus",
+    "set_rng",
 ]
 
+class SlotStatus(IntEnum):                                                                                              # slot status codes kept by "MemoryAccess" and stored in mem_positions[slot].properties['status']
+    IDLE = 0
+    TARGET = 1
+    FILLED = 2
+    RESET = 3
+
+IDLE, TARGET, FILLED, RESET = SlotStatus
+
+_rng = np.random.default_rng()                                                                                          # generator shared by all "MemoryRouting" instances, replaced by "set_rng"
+
+_DETECTION_BATCH = 8192                                                                                                 # number of detection outcomes drawn at once by "MemoryRouting"
+
+_BSM_RESULTS = ((0, 0), (0, 1), (1, 0), (1, 1))                                                                         # Bell state measurement results, indexed by output of BellStateMeasurement QProgram
+
+def set_rng(seed=None):
+    global _rng
+    _rng = np.random.default_rng(seed)                                                                                  # only picked up by protocols created afterwards
+
+
 class RepeaterProtocol(NodeProtocol):
     """Logic of "Repeater" node
 
@@ -37,7 +61,9 @@ class RepeaterProtocol(NodeProtocol):
     """
     def __init__(self, node, mem_config, name=None):
         super().__init__(node, name=name)
-        self.port_names = list(dict(self.node.ports).keys())                                                            # ports to end nodes generated in "setup_network"
+        self.port_names = tuple(self.node.ports)                                                                        # ports to end nodes generated in "setup_network"
+        self._port_A = self.node.ports[self.port_names[0]]
+        self._port_B = self.node.ports[self.port_names[1]]
         self.slots_A = self.node.qmemory.get_matching_positions(
             'origin', value='node_A')                                                                                   # slots designated for storing qubits from node_B
         self.slots_B = self.node.qmemory.get_matching_positions(
@@ -49,66 +75,79 @@ class RepeaterProtocol(NodeProtocol):
                                self.slots_B,
                                mem_config)
 
+        self.add_signal("STORED_ANY")                                                                                   # sent by either "MemoryRouting" subprotocol after it appended a slot to its "filled" queue
+
         self.use_memory = mem_config.pop('use_memory')                                                                  # flag configured by sim_params
-        self._bsm_results = [(0, 0), (0, 1), (1, 0), (1, 1)]                                                            # Bell state measurement results, indexed by output of BellStateMeasurement QProgram
+        self._bsm_results = _BSM_RESULTS                                                                                # shared read-only lookup, see _BSM_RESULTS
 
     def _add_subprotocols(self, node, port_name_A, slots_A, port_name_B, slots_B, mem_config):
-        self.add_subprotocol(MemoryRouting(node, port_name_A, slots_A, mem_config, 'route_node_A'))
-        self.add_subprotocol(MemoryRouting(node, port_name_B, slots_B, mem_config, 'route_node_B'))
+        self.add_subprotocol(MemoryRouting(node, port_name_A, slots_A, mem_config, 'route_node_A', self))
+        self.add_subprotocol(MemoryRouting(node, port_name_B, slots_B, mem_config, 'route_node_B', self))
+
+    def _next_filled(self, filled, access):
+        while filled:
+            slot, generation = filled[0]
+            if access.get_status(slot) == FILLED and access.get_generation(slot) == generation:
+                return slot                                                                                             # oldest slot that is still FILLED by the qubit it was reported for
+            filled.popleft()                                                                                            # slot was RESET or FILLED again since it was reported, drop the stale entry
+        return None
 
     def run(self):
         self.node.subcomponents["Clock_{}".format(self.node.name)].start()
+        success = Signals.SUCCESS
         if self.use_memory is False:
             yield from self._run_no_mem()                                                                               # switch to run no memory logic if not supposed to use memory (zero memory slot case)
         else:
             self.start_subprotocols()
+            qmemory = self.node.qmemory
+            route_A = self.subprotocols['route_node_A']
+            route_B = self.subprotocols['route_node_B']
+            filled_A = route_A.filled
+            filled_B = route_B.filled
             while True:
-                yield self.await_signal(self.subprotocols['route_node_A'], "STORED") | \
-                      self.await_signal(self.subprotocols['route_node_B'], "STORED")                                    # await output from either subprotocol indicating that an incoming qubit was stored in memory
-
-                slot_A = None                                                                                           # will take the value of the first FILLED slot in slots_A
-                slot_B = None                                                                                           # will take the value of the first FILLED slot in slots_B
-                for slot in self.slots_A:
-                    status = self.node.qmemory.mem_positions[slot].properties['status']
-                    if status == "FILLED":
-                        slot_A = slot                                                                                   # store index of first FILLED slot
-                        break
-                for slot in self.slots_B:
-                    status = self.node.qmemory.mem_positions[slot].properties['status']
-                    if status == "FILLED":
-                        slot_B = slot                                                                                   # store index of first FILLED slot
+                yield self.await_signal(self, "STORED_ANY")                                                             # await either subprotocol indicating that an incoming qubit was stored in memory
+
+                pairs_A = []
+                pairs_B = []
+                while True:
+                    slot_A = self._next_filled(filled_A, route_A.access)                                                # oldest FILLED slot in slots_A, None if there is none
+                    slot_B = self._next_filled(filled_B, route_B.access)                                                # oldest FILLED slot in slots_B, None if there is none
+                    if slot_A is None or slot_B is None:                                                                # stop once either side has no FILLED slot left
                         break
-
-                if slot_A and slot_B:                                                                                   # if both changed from None to FILLED
-                    # FIXME: Initial start towards reimplementing actual BSM
-                    # prog = BellMeasurementProgram()
-                    # if self.node.qmemory.busy:
-                    #     yield self.await_program(self.node.qmemory)
-                    # self.node.qmemory.execute_program(prog, qubit_mapping=[slot_A, slot_B])
-                    # yield self.await_program(self.node.qmemory)
-                    # idx, = prog.output['BellStateIndex']
-                    # print(f"AFTER MEASURE : {self._bsm_results[idx]}")
-                    q1, = self.node.qmemory.pop(slot_A)                                                                 # retreive current qubit at slot_A
-                    q2, = self.node.qmemory.pop(slot_B)                                                                 # retreive current qubit at slot_A
+                    filled_A.popleft()
+                    filled_B.popleft()
+                    pairs_A.append(slot_A)
+                    pairs_B.append(slot_B)
+                    route_A.access.set_status(slot_A, RESET)                                                            # flag slot for RESET once taken for measurement, so it cannot be paired again
+                    route_B.access.set_status(slot_B, RESET)                                                            # flag slot for RESET once taken for measurement, so it cannot be paired again
+                if not pairs_A:
+                    continue
+                # FIXME: Initial start towards reimplementing actual BSM
+                # prog = BellMeasurementProgram()
+                # if self.node.qmemory.busy:
+                #     yield self.await_program(self.node.qmemory)
+                # self.node.qmemory.execute_program(prog, qubit_mapping=[slot_A, slot_B])
+                # yield self.await_program(self.node.qmemory)
+                # idx, = prog.output['BellStateIndex']
+                # print(f"AFTER MEASURE : {self._bsm_results[idx]}")
+                qubits = qmemory.pop(pairs_A + pairs_B)                                                                 # retreive qubits of all pairs in a single call, slot_A qubits first
+                num_pairs = len(pairs_A)
+                for i in range(num_pairs):
                     result = {
-                        'qubits': [q1, q2]
+                        'qubits': [qubits[i], qubits[num_pairs + i]]
                     }
-                    self.send_signal(Signals.SUCCESS, result=result)
-
-
-                    self.node.qmemory.mem_positions[slot_A].properties['status'] = "RESET"                              # flag slot for RESET after counted for measurement
-                    self.node.qmemory.mem_positions[slot_B].properties['status'] = "RESET"                              # flag slot for RESET after counted for measurement
+                    self.send_signal(success, result=result)
 
 
     def _run_no_mem(self):                                                                                              # special run case for when memory should not store qubit for any measurable time
+        qmemory = self.node.qmemory
         while True:
-            expr = yield self.await_port_input(self.node.ports[self.port_names[0]]) | \
-                         self.await_port_input(self.node.ports[self.port_names[1]])                                     # wait until qubits arrive at same time
+            yield self.await_port_input(self._port_A) | \
+                  self.await_port_input(self._port_B)                                                                   # wait until qubits arrive at same time
 
-            q1, = self.node.qmemory.pop(0)                                                                              # retreive anything that was just routed to slot 0
-            q2, = self.node.qmemory.pop(1)                                                                              # retreive anything that was just routed to slot 0
+            q1, q2 = qmemory.pop([0, 1])                                                                                # retreive anything that was just routed to slots 0 and 1 in a single call
 
-            if q1 and q2:                                                                                               # if both slots had qubits routed to them, indicates joint arrival
+            if q1 is not None and q2 is not None:                                                                       # if both slots had qubits routed to them, indicates joint arrival
                 result = {
                     'qubits': [q1, q2]
                 }
@@ -120,7 +159,7 @@ class MemoryRouting(NodeProtocol):
 
     * Determines location of available slot (if any)
     * Places qubit into memory slot
-    * Emits "SUCCESS" signal along with newly allocated index number
+    * Emits "STORED_ANY" signal on "repeater" after newly allocated slot is queued in "filled"
 
     Parameters
     ----------
@@ -138,17 +177,26 @@ class MemoryRouting(NodeProtocol):
             Parameter assignments allowing for simplified configuration, passed on to proper protocols
     name : :py:class: str
         specify name of this subprotocol
+    repeater : :py:class: RepeaterProtocol
+        protocol consuming "filled", woken through its "STORED_ANY" signal
 
     """
 
-    def __init__(self, node, port_name, slots, mem_config, name):
+    def __init__(self, node, port_name, slots, mem_config, name, repeater):
         super().__init__(node, name=name)
         self.probability_detection = mem_config['probability_detection']                                                # probability that qubit is detected after interacting with memory
+        self._detection_threshold = self.probability_detection / 100.0                                                  # probability_detection is given in [%]
+        self._rng = _rng
+        self._detections = np.empty(0, dtype=bool)                                                                      # pre-sampled detection outcomes, consumed one per stored qubit
+        self._detection_idx = 0
+        self._progs = (MemoryBehavior(), MemoryBehavior())                                                              # programs to perform realisitc storage of incoming qubit state, indexed by detection outcome
+        for detected, prog in enumerate(self._progs):
+            prog.set_detected(bool(detected))                                                                           # indicate if storage will result in known FILLED slot
 
         self.input_port = port_name
 
 
-        self.node_name = self.name.replace('route_','')
+        self.node_name = self.name.replace('route_', '', 1)
         if self.node_name == 'node_A':
             self.storage_port = 'qin0'                                                                                  # port initially receiving qubits from node_A
             self.storage_idx = 0                                                                                        # slot that input is routed to, not actually accessible for measurement, only temporary storage for QProgram
@@ -158,42 +206,52 @@ class MemoryRouting(NodeProtocol):
 
         self.slots = slots                                                                                              # accessible slots for this connection
 
-        self.signal = "STORED"
-        self.add_signal(self.signal)
+        self.repeater = repeater                                                                                        # "RepeaterProtocol" woken after each slot queued in "filled"
+        self.filled = deque()                                                                                           # (slot, generation) of each FILLED reported by this protocol, oldest first, consumed by "RepeaterProtocol"
 
         self._add_subprotocols(node, slots, mem_config)
 
     def _add_subprotocols(self, node, slots, mem_config):
-        self.add_subprotocol(MemoryAccess(node, slots, mem_config, name='access_'+self.node_name))
+        self.access = MemoryAccess(node, slots, mem_config, name='access_'+self.node_name)                              # kept by reference, queried on every incoming qubit
+        self.add_subprotocol(self.access)
+
+    def _next_detection(self):
+        if self._detection_idx == self._detections.size:
+            self._detections = self._rng.random(_DETECTION_BATCH) < self._detection_threshold                           # refill with a new batch of outcomes
+            self._detection_idx = 0
+        detected = bool(self._detections[self._detection_idx])
+        self._detection_idx += 1
+        return detected
 
     def _get_target_slot(self):
-        for slot in self.slots:
-            status = self.node.qmemory.mem_positions[slot].properties['status']
-            if status == "TARGET":
-                return slot                                                                                             # retrieve current TARGET slot
+        slot = self.access.target_slot                                                                                  # last slot assigned TARGET by "MemoryAccess"
+        if slot is not None and self.access.get_status(slot) == TARGET:
+            return slot                                                                                                 # retrieve current TARGET slot
         return None                                                                                                     # if no slots have that status, return NONE, unable to store qubit
 
 
     def run(self):
         self.start_subprotocols()
+        qmemory = self.node.qmemory
+        input_port = self.node.ports[self.input_port]
         while True:
-            yield self.await_port_input(self.node.ports[self.input_port])                                               # await incoming qubit
+            yield self.await_port_input(input_port)                                                                     # await incoming qubit
 
             target_slot = self._get_target_slot()                                                                       # determine up to date TARGET assignment
 
-            if self.node.qmemory.peek(self.storage_idx) is not None:                                                    # verify that a qubit was actually input on the port
+            if qmemory.peek(self.storage_idx) is not None:                                                              # verify that a qubit was actually input on the port
                 if target_slot != None:                                                                                 # verify that a TARGET slot is assigned
-                    detected = True if np.random.random_integers(1,100) <= self.probability_detection else False        # determine by random sampling if the detector will successful sense qubit after interacting with NiV memory
-                    prog = MemoryBehavior()                                                                             # intitialize program to perform realisitc storage of incoming qubit state
-                    prog.set_detected(detected)                                                                         # indicate if storage will result in known FILLED slot
-                    if self.node.qmemory.busy:
-                        yield self.await_program(self.node.qmemory)
-                    self.node.qmemory.execute_program(prog, qubit_mapping=[self.storage_idx, target_slot])
-                    yield self.await_program(self.node.qmemory)
-                    self.node.qmemory.pop(self.storage_idx)                                                             # clear out temporary bin for input qubits (unecessary as input would overwrite)
+                    detected = self._next_detection()                                                                   # determine by random sampling if the detector will successful sense qubit after interacting with NiV memory
+                    prog = self._progs[detected]
+                    if qmemory.busy:
+                        yield self.await_program(qmemory)
+                    qmemory.execute_program(prog, qubit_mapping=[self.storage_idx, target_slot])
+                    yield self.await_program(qmemory)
+                    qmemory.pop(self.storage_idx)                                                                       # clear out temporary bin for input qubits (unecessary as input would overwrite)
                     if detected:                                                                                        # indicate slot as FILLED if photon detected
-                        self.node.qmemory.mem_positions[target_slot].properties['status'] = "FILLED"
-                        self.send_signal(self.signal, result=target_slot)
+                        self.access.set_status(target_slot, FILLED)
+                        self.filled.append((target_slot, self.access.get_generation(target_slot)))
+                        self.repeater.send_signal("STORED_ANY", result=(self.node_name, target_slot))                   # wake "RepeaterProtocol" through its single merged signal
 
 
 
@@ -202,6 +260,7 @@ class MemoryAccess(NodeProtocol):
 
     * Times the reset period and duration for each slot
     * Assigns new TARGET slot when none is assigned
+    * Keeps the status of each slot, other protocols assign status through `set_status`
 
     Parameters
     ----------
@@ -225,64 +284,106 @@ class MemoryAccess(NodeProtocol):
         self.reset_period_cycles = mem_config['reset_period_cycles']                                                    # number of periods to wait until forcing current index to reset
         self.reset_duration_cycles = mem_config['reset_duration_cycles']                                                # number of periods to force slot inactive during reset phase
 
-        self.reset_timer = dict((slot, self.reset_duration_cycles) for idx, slot in enumerate(slots))                   # dict of reset timers for each individual slot, indexed using valid memory slot from "slots"
-        self.reset_trigger_timer = dict((slot, self.reset_period_cycles) for idx, slot in enumerate(slots))             # dict of countdowns towards reset for the slot that is targeted for storage
-
-    def _reset_state(self, slot):
-        q_default, = ns.qubits.create_qubits(1, no_state=True)
-        ns.qubits.assign_qstate([q_default], ns.h0)                                                                     # create initial default known state to reinitialize slot
-        self.node.qmemory.put(q_default, positions=[slot])                                                              # reset qubit to known state
-        self.node.qmemory.mem_positions[slot].properties['status'] = "IDLE"                                             # assign slot IDLE status, available for use
+        self._slot_idx = {slot: idx for idx, slot in enumerate(slots)}                                                  # position of each slot in "slots", used to index the per-slot arrays below
+        self._props = [node.qmemory.mem_positions[slot].properties for slot in slots]                                   # properties of each slot's memory position, resolved once
+        self.status = np.full(len(slots), IDLE, dtype=np.int8)                                                          # status code of each slot, mirrored to the 'status' property of its memory position
+        self.reset_timer = [self.reset_duration_cycles] * len(slots)                                                    # cycles left until reset is completed, frozen while the slot is not RESET
+        self.reset_trigger_timer = [self.reset_period_cycles] * len(slots)                                              # cycles left until forced reset, frozen while the slot is RESET
+        self.target_slot = None                                                                                         # slot most recently assigned TARGET status, read by "MemoryRouting"
+        self._num_target = 0                                                                                            # number of slots with TARGET status, kept by "_assign"
+        self._generation = [0] * len(slots)                                                                             # number of times each slot was FILLED, kept by "_assign"
+
+        self._now = 0                                                                                                   # number of clock cycles seen so far
+        self._due = [self.reset_period_cycles + 1] * len(slots)                                                         # cycle of the next timer event of each slot, either forced reset or reset completion
+        self._heap = [(due, idx) for idx, due in enumerate(self._due)]                                                  # pending timer events, only the entry matching "_due" of its slot is live
+        heapq.heapify(self._heap)
+
+    def _schedule(self, idx, cycles):
+        due = self._now + cycles + 1                                                                                    # timer is checked on each of the next "cycles" ticks, and expires on the tick after
+        self._due[idx] = due
+        heapq.heappush(self._heap, (due, idx))
+
+    def _assign(self, idx, status):
+        if self.status[idx] == TARGET:
+            self._num_target -= 1
+        if status == TARGET:
+            self._num_target += 1
+        elif status == FILLED:
+            self._generation[idx] += 1
+        self.status[idx] = status
+        self._props[idx]['status'] = status
+
+    def get_status(self, slot):
+        return self.status[self._slot_idx[slot]]
+
+    def get_generation(self, slot):
+        return self._generation[self._slot_idx[slot]]
+
+    def set_status(self, slot, status):                                                                                 # single point of status assignment, used by all protocols sharing this memory half
+        idx = self._slot_idx[slot]
+        if status == RESET and self.status[idx] != RESET:
+            self.reset_trigger_timer[idx] = self._due[idx] - self._now - 1                                              # freeze countdown towards forced reset for the duration of the reset
+            self._schedule(idx, self.reset_timer[idx])
+        elif status != RESET and self.status[idx] == RESET:
+            self.reset_timer[idx] = self._due[idx] - self._now - 1                                                      # slot left RESET before completion (e.g. FILLED by a program that started on it), freeze the remaining reset
+            self._schedule(idx, self.reset_trigger_timer[idx])                                                          # resume countdown towards forced reset
+        self._assign(idx, status)
+
+    def _reset_state(self, slots):
+        q_defaults = ns.qubits.create_qubits(len(slots), no_state=True)
+        for q_default in q_defaults:
+            ns.qubits.assign_qstate([q_default], ns.h0)                                                                 # create initial default known state to reinitialize slot
+        self.node.qmemory.put(q_defaults, positions=slots)                                                              # reset qubits to known state, all slots finishing their reset this cycle in one call
 
     def _get_new_target(self):                                                                                          # find slot to assign as TARGET
-        for slot in self.slots:                                                                                         # check if there is existing target
-            status = self.node.qmemory.mem_positions[slot].properties['status']
-            if status == "TARGET":
-                return
+        if self._num_target:                                                                                            # check if there is existing target
+            return
 
-        for slot in self.slots:                                                                                         # check if there is was no TARGET, try to assign first IDLE slot as TARGET
-            status = self.node.qmemory.mem_positions[slot].properties['status']
-            if status == "IDLE":
-                self.node.qmemory.mem_positions[slot].properties['status'] = "TARGET"                                   # assign new target slot
-                return
+        idle = np.flatnonzero(self.status == IDLE)                                                                      # check if there is was no TARGET, try to assign first IDLE slot as TARGET
+        if idle.size:
+            self.target_slot = self.slots[idle[0]]
+            self.set_status(self.target_slot, TARGET)                                                                   # assign new target slot
 
     def run(self):
-        target_slot = self.slots[0]
-        self.node.qmemory.mem_positions[target_slot].properties['status'] = "TARGET"                                    # indicates to "MemoryRouting" protocol which slot to attempt to store on
+        self.target_slot = self.slots[0]
+        self.set_status(self.target_slot, TARGET)                                                                       # indicates to "MemoryRouting" protocol which slot to attempt to store on
+        clock_port = self.node.subcomponents["Clock_{}".format(self.node.name)].ports['cout']
+        heap = self._heap                                                                                               # containers below are only ever modified in place
+        due_cycles = self._due
+        status = self.status
+        slots = self.slots
 
         while True:
 
-            yield self.await_port_output(self.node.subcomponents["Clock_{}".format(self.node.name)].ports['cout'])
-
-            for slot in self.slots:
-                status = self.node.qmemory.mem_positions[slot].properties['status']
-                if status == "RESET":
-                    if self.reset_timer[slot] == 0:
-                        self._reset_state(slot)                                                                         # call function to handle reset to default "known" qubit state and IDLE status
-                        self.reset_timer[slot] = self.reset_duration_cycles                                             # restore reset timer for next time
-                    else:
-                        self.reset_timer[slot] -= 1
-                elif status == "TARGET":
-                    if self.reset_trigger_timer[slot] == 0:
-                        self.node.qmemory.mem_positions[slot].properties['status'] = "RESET"                            # flag slot as RESET
-                        self.reset_trigger_timer[slot] = self.reset_period_cycles                                       # reset timer for next occurrence
-                    else:
-                        self.reset_trigger_timer[slot] -= 1
-
-                elif status == "IDLE":
-                    if self.reset_trigger_timer[slot] == 0:
-                        self.node.qmemory.mem_positions[slot].properties['status'] = "RESET"                            # flag slot as RESET
-                        self.reset_trigger_timer[slot] = self.reset_period_cycles                                       # reset timer for next occurrence
-                    else:
-                        self.reset_trigger_timer[slot] -= 1
-
-                elif status == "FILLED":
-                    if self.reset_trigger_timer[slot] == 0:
-                        self.node.qmemory.mem_positions[slot].properties['status'] = "RESET"                            # flag slot as RESET
-                        self.reset_trigger_timer[slot] = self.reset_period_cycles                                       # reset timer for next occurrence
-                    else:
-                        self.reset_trigger_timer[slot] -= 1
-
+            yield self.await_port_output(clock_port)
+
+            self._now += 1
+            now = self._now
+            if heap[0][0] > now and self._num_target:
+                continue                                                                                                # no timer expires and a TARGET is assigned, nothing to do this cycle
+            reset_done = []
+            checked = False                                                                                             # TARGET assignment was checked after a preceding slot this cycle
+            while heap and heap[0][0] <= now:                                                                           # only slots with an expiring timer are touched this cycle, in slot order
+                due, idx = heapq.heappop(heap)
+                if due != due_cycles[idx]:
+                    continue                                                                                            # event was superseded by a later status change of the slot
+                if idx and not checked:
+                    self._get_new_target()                                                                              # TARGET assignment following the untouched slots before this one
+                if status[idx] == RESET:
+                    reset_done.append(slots[idx])
+                    self.reset_timer[idx] = self.reset_duration_cycles                                                  # restore reset timer for next time
+                    self._schedule(idx, self.reset_trigger_timer[idx])                                                  # resume countdown towards forced reset
+                    self._assign(idx, IDLE)                                                                             # assign slot IDLE status, available for use
+                else:
+                    self.reset_trigger_timer[idx] = self.reset_period_cycles                                            # reset timer for next occurrence
+                    self._schedule(idx, self.reset_timer[idx])
+                    self._assign(idx, RESET)                                                                            # flag slot as RESET
+                self._get_new_target()                                                                                  # call function to handle TARGET assignment, after each slot
+                checked = True
+            if reset_done:
+                self._reset_state(reset_done)                                                                           # call function to handle reset to default "known" qubit state
+
+            if not checked:
                 self._get_new_target()                                                                                  # call function to handle TARGET assignment
 
 
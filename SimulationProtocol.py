@@ -1,4 +1,4 @@
-import netsquid as ns
+import numpy as np
 from netsquid.protocols import LocalProtocol, Signals
 from netsquid.qubits import qubitapi as qapi, ketstates as ks
 from RepeaterProtocol import RepeaterProtocol
@@ -8,6 +8,13 @@ from SourceProtocol import SourceProtocol
 __all__ = [
     "SimulationProtocol",
 ]
+
+_S11 = np.asarray(ks.s11).ravel()                                                                                       # reference state of the emitted pair, flattened once for "_fidelity"
+
+def _fidelity(qubits, ket):
+    rho = qapi.reduced_dm(qubits)
+    return float(np.vdot(ket, rho @ ket).real)                                                                          # squared fidelity <ket|rho|ket>, same as qapi.fidelity(..., squared=True) for a pure reference
+
 class SimulationProtocol(LocalProtocol):
     """Logic of simulation
 
@@ -56,17 +63,19 @@ class SimulationProtocol(LocalProtocol):
 
     def run(self):
         self.start_subprotocols()
+        repeater = self.subprotocols['repeater_R']
+        success = Signals.SUCCESS
         while True:
-            yield self.await_signal(self.subprotocols['repeater_R'], Signals.SUCCESS)
+            yield self.await_signal(repeater, success)
 
-            repeater_result = self.subprotocols['repeater_R'].get_signal_result(label=Signals.SUCCESS, receiver=self)
+            repeater_result = repeater.get_signal_result(label=success, receiver=self)
             q1,q2 = repeater_result['qubits']                                                                           # retrieve qubits that were popped from memory by RepeaterProtocol
 
 
-            fid_joint = qapi.fidelity([q1,q2], ks.s11, squared=True)                                                    # measure joint fidelity (compared to emitted 's1' state) of qubits once they were marked for measurement
+            fid_joint = _fidelity([q1,q2], _S11)                                                                        # measure joint fidelity (compared to emitted 's1' state) of qubits once they were marked for measurement
             result = {
                 'pos_A': None,                                                                                          # FIXME: Useful for extra statistics to plot, would need to pass which slot was used for measurement
                 'pos_B': None,                                                                                          # FIXME: Useful for extra statistics to plot, would need to pass which slot was used for measurement
                 'fid_joint': fid_joint
             }
-            self.send_signal(Signals.SUCCESS, result=result)
+            self.send_signal(success, result=result)
@@ -4,8 +4,18 @@ from netsquid.protocols import NodeProtocol, Signals
 
 __all__ = [
     "SourceProtocol",
+    "set_rng",
 ]
 
+_rng = np.random.default_rng()                                                                                          # generator shared by all "SourceProtocol" instances, replaced by "set_rng"
+
+_EMISSION_BATCH = 4096                                                                                                  # number of emission outcomes drawn at once
+
+def set_rng(seed=None):
+    global _rng
+    _rng = np.random.default_rng(seed)                                                                                  # only picked up by protocols created afterwards
+
+
 class SourceProtocol(NodeProtocol):
     """Logic to control probabilistic source emission
 
@@ -23,12 +33,41 @@ class SourceProtocol(NodeProtocol):
     def __init__(self, node, source_config, name):
         super().__init__(node=node, name=name)
         self.probability_emission = source_config['probability_emission']                                               # probability of actually triggering QSource emission when clock ticks
+        self._emission_threshold = self.probability_emission / 100.0                                                    # probability_emission is given in [%]
+        self._rng = _rng
+        self._emissions = np.empty(0, dtype=bool)                                                                       # pre-sampled emission outcomes, consumed one per clock cycle
+        self._emission_idx = 0
+
+        self._clock = self.node.subcomponents['Clock_{}'.format(self.node.name)]                                        # clock for this particular node to time its source emission
+        self._clock_port = self._clock.ports['cout']
+        self._qsource = self.node.subcomponents['QSource_{}'.format(self.node.name)]
+        self.add_signal("STOP")                                                                                         # sent by "stop", keeps "run" alive until then
+
+    def _next_emission(self):
+        if self._emission_idx == self._emissions.size:
+            self._emissions = self._rng.random(_EMISSION_BATCH) < self._emission_threshold                              # refill with a new batch of outcomes
+            self._emission_idx = 0
+        emitted = bool(self._emissions[self._emission_idx])
+        self._emission_idx += 1
+        return emitted
+
+    def start(self):
+        self._clock_port.bind_output_handler(self._on_tick)                                                             # emit directly from the clock port handler, no protocol wake-up per tick
+        super().start()
+
+    def stop(self):
+        self._clock_port.bind_output_handler(None)                                                                      # unbind "_on_tick", the clock may keep ticking after this protocol stops
+        if self.is_running:
+            self.send_signal("STOP")                                                                                    # release "run"
+        super().stop()
+
+    def _on_tick(self, message):
+        if not self.is_running:
+            return
+        if self._next_emission():                                                                                       # determine if source should actually emit a qubit this cycle by random sampling
+            self._qsource.trigger()                                                                                     # manually trigger source when emission is sampled for this cycle
+            self.send_signal(Signals.SUCCESS, result=ns.sim_time())
 
     def run(self):
-        self.node.subcomponents['Clock_{}'.format(self.node.name)].start()                                              # clock for this particular node to time its source emission
-        while True:
-            yield self.await_port_output(self.node.subcomponents['Clock_{}'.format(self.node.name)].ports['cout'])
-            emitted = True if np.random.random_integers(1, 100) <= self.probability_emission else False                 # determine if source should actually emit a qubit this cycle by random sampling [1,100]
-            if emitted:
-                self.node.subcomponents['QSource_{}'.format(self.node.name)].trigger()                                  # manually trigger source when "emitted" is True for this cycle
-                self.send_signal(Signals.SUCCESS, result=ns.sim_time())
+        self._clock.start()
+        yield self.await_signal(self, "STOP")                                                                           # emission is handled by "_on_tick", only wait to be stopped
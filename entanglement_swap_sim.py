@@ -1,3 +1,6 @@
+import functools
+import multiprocessing
+import numpy as np
 import pandas
 import pydynaa as pd
 import netsquid as ns
@@ -14,6 +17,8 @@ from netsquid.components import QSource
 # from qsource import QSource                                                                                             # use localy modified version of QSource (from when trying to use "Number state" qubits)
 from FibreLossModel import FibreLossModel
 from SimulationProtocol import SimulationProtocol
+from SourceProtocol import set_rng as set_emission_rng
+from RepeaterProtocol import IDLE, set_rng as set_detection_rng
 
 
 def setup_network(source_attempts,
@@ -33,6 +38,7 @@ def setup_network(source_attempts,
     memory_T1 = kwargs.get('memory_T1', 1.0e8)
     memory_T2 = kwargs.get('memory_T2', 1.0e4)
     physical_instructions = kwargs.get('physical_instructions', None)
+    formalism = kwargs.get('formalism', QFormalism.DM)
 
 
 
@@ -73,7 +79,7 @@ def setup_network(source_attempts,
     network = Network('Entanglement_swap')
     node_a, node_b, node_r = network.add_nodes(['node_A', 'node_B', 'node_R'])
 
-    state_sampler = StateSampler(qs_reprs=[ks.s11], probabilities=[1.0], formalism=QFormalism.DM)                        # define desired states to be generated by source
+    state_sampler = StateSampler(qs_reprs=[ks.s11], probabilities=[1.0], formalism=formalism)                            # define desired states to be generated by source
 
     # Setup end node A:
     source_a = QSource(name='QSource_node_A',
@@ -98,34 +104,33 @@ def setup_network(source_attempts,
     # Setup midpoint repeater node R:
     if memory_depth == 0:                                                                                               # special case, initialize non-physical processor to handle measurement on simultaneous input
         total_positions = 2
-        qprocessor_r = QuantumProcessor(name='QProcessor_R',
-                                  num_positions=total_positions,
-                                  fallback_to_nonphysical=True,
-                                  phys_instructions=None,
-                                  memory_noise_models=None)
+        processor_instructions = None
+        processor_noise_models = None
     else:
         total_positions = memory_depth*2 + 2
-        qprocessor_r = QuantumProcessor(name='QProcessor_R',
-                                  num_positions=total_positions,
-                                  fallback_to_nonphysical=True,
-                                  phys_instructions=physical_instructions,
-                                  memory_noise_models=memory_model)
+        processor_instructions = physical_instructions
+        processor_noise_models = memory_model
+    qprocessor_r = QuantumProcessor(name='QProcessor_R',
+                                    num_positions=total_positions,
+                                    fallback_to_nonphysical=True,
+                                    phys_instructions=processor_instructions,
+                                    memory_noise_models=processor_noise_models)
 
     if memory_depth != 0:                                                                                               # initialization of memories
         for position in qprocessor_r.mem_positions[2: memory_depth+2]:
             memory_default, = ns.qubits.create_qubits(1, no_state=True)
-            ns.qubits.assign_qstate([memory_default], ns.h0, formalism=QFormalism.DM)
+            ns.qubits.assign_qstate([memory_default], ns.h0, formalism=formalism)
             position.add_property('origin', value=node_a.name)                                                          # first half of qmemory is allocated for qubits from node_A
             position.set_qubit(memory_default)                                                                          # initialize to default state
             position.in_use = False
-            position.add_property(name='status', value="IDLE")
+            position.add_property(name='status', value=IDLE)
         for position in qprocessor_r.mem_positions[memory_depth+2:]:
             memory_default, = ns.qubits.create_qubits(1, no_state=True)
-            ns.qubits.assign_qstate([memory_default], ns.h0, formalism=QFormalism.DM)
+            ns.qubits.assign_qstate([memory_default], ns.h0, formalism=formalism)
             position.add_property('origin', value=node_b.name)                                                          # second half of qmemory is allocated for qubits from node_B
             position.set_qubit(memory_default)                                                                          # initialize to default state
             position.in_use = False
-            position.add_property(name='status', value="IDLE")
+            position.add_property(name='status', value=IDLE)
 
         qprocessor_r.set_position_used(True, position=0)                                                                # flag as used, never accessed for storage, used as holding location to sort into memory
         qprocessor_r.set_position_used(True, position=1)                                                                # flag as used, never accessed for storage
@@ -179,10 +184,10 @@ def sim_setup(network, source_config, memory_config):
 
 
 def run_simulation(sim_params, attempts, memory_depths):
-    simulation_data = pandas.DataFrame()
+    rows = []                                                                                                           # one row per memory depth, built into a single df once all runs are done
     for memory_depth in memory_depths:
         ns.sim_reset()                                                                                                  # reset simulation stats/time each run
-        ns.set_qstate_formalism(QFormalism.DM)                                                                          # set formalism to ensure noise/error is calculated accurately
+        ns.set_qstate_formalism(sim_params.get('formalism', QFormalism.DM))                                             # set formalism, DM by default to ensure noise/error is calculated accurately
         # phys_instructions = [PhysicalInstruction(instr.INSTR_MEASURE_BELL, duration=5.0, parallel=True)]              # FIXME: possibly for later use
 
         network = setup_network(source_attempts=attempts,
@@ -206,36 +211,44 @@ def run_simulation(sim_params, attempts, memory_depths):
         entangle_sim, dc = sim_setup(network, source_config, memory_config)
         entangle_sim.start()
         stats = ns.sim_run()                                                                                            # run until out of attempts on source clocks
-
-        if dc.dataframe.empty:                                                                                          # build df for case with no successes
-            data = [{'Memory Depth': memory_depth,
-                     'num_meas': 0,
-                     'fid_joint': None}]
-            df = pandas.DataFrame(data)
-        else:                                                                                                           # build df for each run from data collector
-            fid_joint = dc.dataframe['fid_joint'].mean()                                                                # avg joint fidelity
-            num_meas = len(dc.dataframe)                                                                                # number of measurement events during run
-            mem_use_A = dc.dataframe['pos_A'].value_counts()
-            mem_use_B = dc.dataframe['pos_B'].value_counts()
-            mem_use = mem_use_A.append(mem_use_B)                                                                       # FIXME: for future use, tracking which mem slots are used
-            data = [{'Memory Depth': memory_depth,
-                     'num_meas': num_meas,
-                     'fid_joint': fid_joint}]
-
-            df = pandas.DataFrame(data)                                                                                 # pack data on each run in df
-        simulation_data = simulation_data.append(df)                                                                    # append df for each run to simulation data
-    return simulation_data
+        run_data = dc.dataframe                                                                                         # data collector builds a new df on every access, build it once per run
+
+        if run_data.empty:                                                                                              # build row for case with no successes
+            row = {'Memory Depth': memory_depth,
+                   'num_meas': 0,
+                   'fid_joint': None}
+        else:                                                                                                           # build row for each run from data collector
+            fid_joint = run_data['fid_joint'].mean()                                                                    # avg joint fidelity
+            num_meas = len(run_data)                                                                                    # number of measurement events during run
+            mem_use_A = run_data['pos_A'].value_counts()
+            mem_use_B = run_data['pos_B'].value_counts()
+            mem_use = pandas.concat([mem_use_A, mem_use_B])                                                             # FIXME: for future use, tracking which mem slots are used
+            row = {'Memory Depth': memory_depth,
+                   'num_meas': num_meas,
+                   'fid_joint': fid_joint}
+        rows.append(row)                                                                                                # append row for each run to simulation data
+    return pandas.DataFrame(rows)
+
+
+def run_iteration(sim_params, attempts, memory_depths, seed_sequence):                                                  # run one independent iteration, in a worker process of "repeat_simulation"
+    ns_seed, detection_seed, emission_seed = seed_sequence.spawn(3)                                                     # independent streams for netsquid, detection and emission sampling
+    ns.set_random_state(seed=int(ns_seed.generate_state(1)[0]))
+    set_detection_rng(detection_seed)
+    set_emission_rng(emission_seed)
+    return run_simulation(sim_params, attempts, memory_depths)
 
 
 def repeat_simulation(sim_params, attempts, iterations, memory_depths):                                                 # run simulation for given amount of iterations
-    total_data = pandas.DataFrame()
-    for iteration in range(iterations):
-        simulation_data = run_simulation(sim_params, attempts, memory_depths)
-        simulation_data.insert(0, 'iteration', iteration)
-        print(f"ON ITERATION: {iteration}")
-        print(simulation_data)
-        total_data = total_data.append(simulation_data)                                                                 # compile data from each iteration into total_data
-    return total_data
+    frames = []
+    seed_sequences = np.random.SeedSequence(sim_params.get('seed')).spawn(iterations)                                   # one seed per iteration, so iterations differ but a seeded run is repeatable
+    run = functools.partial(run_iteration, sim_params, attempts, memory_depths)
+    with multiprocessing.Pool(processes=sim_params.get('workers')) as pool:                                             # iterations are independent, run them in parallel, one process per CPU if 'workers' is None or missing
+        for iteration, simulation_data in enumerate(pool.imap(run, seed_sequences)):                                    # printed while the pool runs, in iteration order
+            simulation_data.insert(0, 'iteration', iteration)
+            print(f"ON ITERATION: {iteration}")
+            print(simulation_data)
+            frames.append(simulation_data)                                                                              # compile data from each iteration into total_data
+    return pandas.concat(frames, ignore_index=True) if frames else pandas.DataFrame()                                   # concat rejects an empty list, zero iterations give an empty frame
 
 
 def create_plot(sim_params, attempts, iterations, memory_depths):
@@ -317,12 +330,16 @@ sim_params = {
     'memory_T2': 0.5e4,             # [ns]      : dephasing time of quantum memory state (WARNING: must have T1 > T2)
     'memory_reset_period': 50,     # [cycles]  : number of clock cycles (at universally set frequency), until reset is automatically triggered
     'memory_reset_duration': 100,   # [cycles]  : number of clock cycles (at universally set frequency), until reset is completed
-    'probability_detection': 90    # [%]       : probability of successful detection after interacting with memory
+    'probability_detection': 90,   # [%]       : probability of successful detection after interacting with memory
+    'seed': None,                   # [-]       : seed for random number generators, None for a non-repeatable run
+    'formalism': QFormalism.DM,     # [-]       : qubit state formalism, KET is faster but samples memory noise per run instead of tracking it exactly
+    'workers': None                 # [-]       : number of processes running iterations in parallel, None (or left out) for one per CPU (os.cpu_count())
 }
 
 memory_depths = [0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,30,40,50]
 attempts = 1000
 iterations = 5
 
-create_plot(sim_params, attempts, iterations, memory_depths)
-ns.sim_reset()
\ No newline at end of file
+if __name__ == '__main__':                                                                                              # guard so worker processes importing this module do not start their own sweep
+    create_plot(sim_params, attempts, iterations, memory_depths)
+    ns.sim_reset()
\ No newline at end of file